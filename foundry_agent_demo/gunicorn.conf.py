@@ -1,15 +1,18 @@
 import os
-import multiprocessing
 
 # Server socket
 bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# gevent lets each worker keep many agent runs in flight while they poll, so a
+# couple of workers cover the I/O-bound load
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+worker_class = "gevent"
+# Makes the preloaded app monkey-patch sockets before its SDK imports
+os.environ.setdefault('USE_GEVENT', '1')
 worker_connections = 1000
-timeout = 30
+timeout = 120
 keepalive = 2
 
 # Restart workers after this many requests, to help prevent memory leaks
@@ -3,24 +3,194 @@ Invoice Agent API for Azure Container Apps
 A Flask API that wraps the Azure AI Agents invoice processing functionality
 """
 
-from flask import Flask, request, jsonify
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
-from azure.ai.agents.models import ListSortOrder
 import os
+
+# Patch sockets/ssl before requests or azure.* are imported, so blocking SDK
+# calls yield to other greenlets instead of stalling the whole worker
+if os.getenv('USE_GEVENT'):
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, request
+from flask_compress import Compress
+from werkzeug.exceptions import RequestEntityTooLarge
+from azure.ai.projects import AIProjectClient
+from azure.identity import (
+    AzureCliCredential,
+    ChainedTokenCredential,
+    EnvironmentCredential,
+    ManagedIdentityCredential,
+)
+from azure.ai.agents.models import (
+    AgentThreadCreationOptions,
+    ListSortOrder,
+    MessageRole,
+    MessageStatus,
+    RunStatus,
+    SubmitToolOutputsAction,
+    ThreadMessageOptions,
+)
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.core.pipeline.transport import RequestsTransport
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+import requests
+import time
+import uuid
+import functools
+import threading
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+import orjson
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# azure-core logs and formats every HTTP request/response at INFO; keep only
+# warnings and errors from the SDK unless AZURE_LOG_LEVEL asks for more
+azure_log_level = logging.getLevelName((os.getenv('AZURE_LOG_LEVEL') or 'WARNING').strip().upper())
+if not isinstance(azure_log_level, int):
+    logger.warning(f"Ignoring invalid AZURE_LOG_LEVEL {os.getenv('AZURE_LOG_LEVEL')!r}; using WARNING")
+    azure_log_level = logging.WARNING
+logging.getLogger('azure').setLevel(azure_log_level)
+
 app = Flask(__name__)
 
+# Chat bodies are small; cap them so one request cannot exhaust worker memory
+MAX_REQUEST_BYTES = 256 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# Compress JSON responses (conversations are mostly text), preferring Brotli
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+JSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+def json_response(obj, status=200):
+    """Serialize a response body with orjson, which encodes datetimes natively"""
+    return app.response_class(
+        orjson.dumps(obj, option=JSON_OPTIONS),
+        status=status,
+        mimetype='application/json'
+    )
+
+def _static_error(message, status):
+    """Pre-encode a fixed error body so error paths skip JSON encoding"""
+    return (orjson.dumps({"success": False, "error": message}), status)
+
+ERR_NO_SERVICE = _static_error("Invoice service not available", 503)
+ERR_INVALID_JSON = _static_error("Request body is not valid JSON", 400)
+ERR_MISSING_MESSAGE = _static_error("Missing 'message' in request body", 400)
+ERR_INVALID_FIELDS = _static_error("'message' and 'thread_id' must be strings", 400)
+ERR_TOO_LARGE = _static_error(f"Request body exceeds {MAX_REQUEST_BYTES} bytes", 413)
+ERR_BUSY = _static_error("Agent is busy; retry the request", 503)
+
+def error_response(error):
+    """Return one of the pre-encoded ERR_* bodies"""
+    body, status = error
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def log_exception(message):
+    """Log the active exception under a fresh correlation id and return the id"""
+    # The full SDK error (often including HTTP bodies) goes to the log only;
+    # clients get the id to quote when reporting the failure
+    cid = uuid.uuid4().hex
+    logger.exception(f"{message} (cid={cid})")
+    return cid
+
+def internal_error(message):
+    """500 response carrying a short message and a correlation id for the logs"""
+    return json_response({
+        "success": False,
+        "error": message,
+        "cid": log_exception(message)
+    }, 500)
+
+def _utcnow():
+    """Current time as a timezone-aware UTC datetime"""
+    return datetime.now(timezone.utc)
+
+def format_conversation(messages):
+    """Convert SDK thread messages into conversation entries, skipping non-text messages"""
+    return [
+        {
+            "role": msg.role,
+            "content": msg.text_messages[-1].text.value,
+            "timestamp": getattr(msg, 'created_at', None) or _utcnow()
+        }
+        for msg in messages if msg.text_messages
+    ]
+
+# Run states in which the agent is still working; anything else is terminal
+ACTIVE_RUN_STATUSES = (RunStatus.QUEUED, RunStatus.IN_PROGRESS, RunStatus.REQUIRES_ACTION)
+# Polls start fast so short runs return quickly, then back off to limit
+# round trips on long ones
+RUN_POLL_INITIAL_INTERVAL = float(os.getenv('RUN_POLL_INITIAL_INTERVAL', 0.1))
+RUN_POLL_MAX_INTERVAL = float(os.getenv('RUN_POLL_MAX_INTERVAL', 1.0))
+def run_error_message(run):
+    """Describe a run that did not complete, e.g. Agent run failed: <reason>"""
+    # ThreadRun.status is a RunStatus member, whose str() is the enum name
+    status = RunStatus(run.status).value
+    reason = run.last_error.message if run.last_error else None
+    return f"Agent run {status}: {reason}" if reason else f"Agent run {status}"
+
+# Runs still active after this long are cancelled. gunicorn's gevent workers
+# have no per-request timeout, so together with CHAT_WAIT_TIMEOUT this is
+# what bounds a chat request.
+RUN_TIMEOUT_SECONDS = float(os.getenv('RUN_TIMEOUT_SECONDS', 100))
+# How long to wait for a cancelled run to leave the cancelling state, so the
+# next message on its thread does not find it still active
+RUN_CANCEL_TIMEOUT_SECONDS = float(os.getenv('RUN_CANCEL_TIMEOUT_SECONDS', 10))
+
+# Formatted conversations keyed by thread and newest message id. Threads are
+# append-only, so an entry stays valid until a new message changes the head,
+# as long as the head itself is finished (a run may still be writing it).
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 10000))
+CONVERSATION_CACHE_TTL = int(os.getenv('CONVERSATION_CACHE_TTL', 300))
+
+# Page size bounds for the thread messages endpoint; the service caps pages at 100
+MESSAGES_DEFAULT_LIMIT = 50
+MESSAGES_MAX_LIMIT = 100
+ERR_INVALID_LIMIT = _static_error(f"'limit' must be an integer between 1 and {MESSAGES_MAX_LIMIT}", 400)
+ERR_THREAD_NOT_FOUND = _static_error("Thread not found", 404)
+ERR_INVALID_MESSAGES_QUERY = _static_error("Invalid thread id or 'after' cursor", 400)
+
+# Keep-alive pool shared by every SDK call in a worker, sized for gevent concurrency
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 64))
+
+# At most CHAT_MAX_CONCURRENCY agent runs in flight per worker. The default
+# matches the HTTP pool so every in-flight run's SDK calls reuse a pooled
+# keep-alive connection; beyond that urllib3 opens and discards extra ones.
+# A request that cannot start within CHAT_WAIT_TIMEOUT seconds is turned away.
+CHAT_MAX_CONCURRENCY = int(os.getenv('CHAT_MAX_CONCURRENCY', HTTP_POOL_SIZE))
+CHAT_WAIT_TIMEOUT = float(os.getenv('CHAT_WAIT_TIMEOUT', 30))
+
+def build_http_session():
+    """Create a requests session with a pooled HTTPS adapter"""
+    # Pooling only: azure-core's RetryPolicy already retries 408/429/5xx, and
+    # retrying here as well would multiply the attempts per call
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+@functools.lru_cache(maxsize=16)
+def _get_agent_cached(project_client, agent_id):
+    """Fetch agent metadata once per process, since agents do not change while it runs"""
+    agent = project_client.agents.get_agent(agent_id)
+    logger.info(f"Successfully connected to agent: {agent.name if hasattr(agent, 'name') else 'Unknown'}")
+    return agent
+
 class InvoiceAgentService:
     def __init__(self):
         self.project_client = None
         self.agent_id = None
+        self._conversation_cache = TTLCache(maxsize=CONVERSATION_CACHE_SIZE, ttl=CONVERSATION_CACHE_TTL)
+        self._conversation_lock = threading.Lock()
         self.setup_client()
     
     def setup_client(self):
@@ -30,51 +200,172 @@ class InvoiceAgentService:
             endpoint = os.getenv('AZURE_AI_PROJECT_ENDPOINT')
             self.agent_id = os.getenv('AZURE_AI_AGENT_ID')
             
-            # Try Managed Identity first (for Azure Container Apps), then DefaultAzureCredential
-            # try:
-            #     credential = ManagedIdentityCredential()
-            #     logger.info("Using Managed Identity for authentication")
-            # except Exception:
-            credential = DefaultAzureCredential()
-            logger.info("Using Default Azure Credential for authentication")
+            # Only the sources this app actually runs with, instead of every
+            # DefaultAzureCredential probe: service principal env vars, the
+            # Container Apps managed identity, then the Azure CLI for local
+            # development. EnvironmentCredential goes first because it makes no
+            # network call when unconfigured.
+            credential = ChainedTokenCredential(
+                EnvironmentCredential(),
+                ManagedIdentityCredential(client_id=os.getenv('AZURE_CLIENT_ID')),
+                AzureCliCredential()
+            )
+            logger.info("Using environment, managed identity or Azure CLI credential for authentication")
             
+            # The agent lookup is deferred to the first request so that
+            # creating the service makes no network calls
             self.project_client = AIProjectClient(
                 credential=credential,
-                endpoint=endpoint
+                endpoint=endpoint,
+                transport=RequestsTransport(session=build_http_session(), session_owner=False),
+                logging_enable=False
             )
             
-            # Test the connection
-            agent = self.project_client.agents.get_agent(self.agent_id)
-            logger.info(f"Successfully connected to agent: {agent.name if hasattr(agent, 'name') else 'Unknown'}")
-            
         except Exception as e:
             logger.error(f"Failed to setup Azure AI Project client: {str(e)}")
             raise
     
+    def get_agent(self):
+        """Fetch the configured agent, connecting on first use"""
+        return _get_agent_cached(self.project_client, self.agent_id)
+    
+    def wait_for_run(self, thread_id, run):
+        """Poll a run with exponential backoff until it finishes
+        
+        Returns the final run and an error message, which is None unless the
+        run had to be cancelled.
+        """
+        # time.sleep yields to other greenlets under the gevent worker, so
+        # in-flight runs share one worker instead of blocking it
+        deadline = time.monotonic() + RUN_TIMEOUT_SECONDS
+        interval = RUN_POLL_INITIAL_INTERVAL
+        while run.status in ACTIVE_RUN_STATUSES:
+            if run.status == RunStatus.REQUIRES_ACTION:
+                error_msg = self._unhandled_action(run)
+                if error_msg:
+                    return self._cancel_run(thread_id, run, error_msg)
+            if time.monotonic() >= deadline:
+                return self._cancel_run(thread_id, run, f"Agent run timed out after {RUN_TIMEOUT_SECONDS:g}s")
+            
+            time.sleep(interval)
+            run = self.project_client.agents.runs.get(thread_id=thread_id, run_id=run.id)
+            interval = min(interval * 2, RUN_POLL_MAX_INTERVAL)
+        return run, None
+    
+    def _unhandled_action(self, run):
+        """Return why a REQUIRES_ACTION run cannot proceed, or None to keep waiting"""
+        # Mirrors create_and_process for a client with no local functions:
+        # server-side tools (e.g. Azure Functions) complete on their own, but
+        # nothing here can produce outputs for function tool calls
+        action = run.required_action
+        if not isinstance(action, SubmitToolOutputsAction):
+            return None
+        tool_calls = action.submit_tool_outputs.tool_calls
+        if not tool_calls:
+            return "Agent run requested tool outputs without any tool calls"
+        if any(tool_call.type == "function" for tool_call in tool_calls):
+            return "Agent run requested a function tool call this service does not provide"
+        return None
+    
+    def _cancel_run(self, thread_id, run, error_msg):
+        """Cancel an active run and wait for it to stop, returning the run and the reason"""
+        logger.warning(f"Cancelling run {run.id} on thread {thread_id}: {error_msg}")
+        try:
+            run = self.project_client.agents.runs.cancel(thread_id=thread_id, run_id=run.id)
+        except HttpResponseError:
+            # The run may have finished since the last poll, which makes it
+            # uncancellable; if so, report it as it ended
+            run = self.project_client.agents.runs.get(thread_id=thread_id, run_id=run.id)
+            if run.status not in ACTIVE_RUN_STATUSES:
+                return run, None
+            raise
+        
+        deadline = time.monotonic() + RUN_CANCEL_TIMEOUT_SECONDS
+        interval = RUN_POLL_INITIAL_INTERVAL
+        while run.status in ACTIVE_RUN_STATUSES + (RunStatus.CANCELLING,):
+            if time.monotonic() >= deadline:
+                logger.warning(f"Run {run.id} on thread {thread_id} still {RunStatus(run.status).value} after cancel")
+                break
+            time.sleep(interval)
+            run = self.project_client.agents.runs.get(thread_id=thread_id, run_id=run.id)
+            interval = min(interval * 2, RUN_POLL_MAX_INTERVAL)
+        return run, error_msg
+    
+    def list_conversation(self, thread_id, limit=MESSAGES_DEFAULT_LIMIT, after=None):
+        """Return one page of a thread's conversation and the cursor for the next page
+        
+        Pages are cached by the thread's newest message, so repeated reads of
+        an unchanged thread skip the listing. Nothing is cached while that
+        message is still being written.
+        """
+        # Cheap HEAD: only the newest message id is needed to validate the cache
+        head = next(iter(self.project_client.agents.messages.list(
+            thread_id=thread_id,
+            limit=1,
+            order=ListSortOrder.DESCENDING
+        )), None)
+        key = f"conv:{thread_id}:{head.id if head else ''}:{limit}:{after or ''}"
+        
+        with self._conversation_lock:
+            page = self._conversation_cache.get(key)
+        if page is not None:
+            return page
+        
+        # Fetch a single page starting after the cursor instead of walking every page
+        pages = self.project_client.agents.messages.list(
+            thread_id=thread_id,
+            limit=limit,
+            order=ListSortOrder.ASCENDING
+        ).by_page(continuation_token=after)
+        messages = list(next(pages, []))
+        
+        # A full page means there may be more; the last id is the next cursor
+        next_cursor = messages[-1].id if len(messages) == limit else None
+        page = (format_conversation(messages), next_cursor)
+        
+        # An in-progress head keeps its id while its text changes
+        if head is None or head.status != MessageStatus.IN_PROGRESS:
+            with self._conversation_lock:
+                self._conversation_cache[key] = page
+        return page
+    
     def process_invoice_message(self, user_message, thread_id=None):
         """Process a message using the invoice agent"""
         try:
-            # Create a new thread if not provided
+            self.get_agent()
+            
             if not thread_id:
-                thread = self.project_client.agents.threads.create()
-                thread_id = thread.id
+                # Create the thread, its first message and the run in one call
+                run = self.project_client.agents.create_thread_and_run(
+                    agent_id=self.agent_id,
+                    thread=AgentThreadCreationOptions(messages=[
+                        ThreadMessageOptions(role=MessageRole.USER, content=user_message)
+                    ])
+                )
+                thread_id = run.thread_id
                 logger.info(f"Created new thread: {thread_id}")
+            else:
+                # Create user message
+                message = self.project_client.agents.messages.create(
+                    thread_id=thread_id,
+                    role="user",
+                    content=user_message
+                )
+                
+                # Start the run. The SDK has no prompt-cache parameter; the
+                # service caches stable prompt prefixes on its own, so runs pass
+                # no per-run instructions that would change the prefix.
+                run = self.project_client.agents.runs.create(
+                    thread_id=thread_id,
+                    agent_id=self.agent_id
+                )
             
-            # Create user message
-            message = self.project_client.agents.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=user_message
-            )
-            
-            # Run the agent
-            run = self.project_client.agents.runs.create_and_process(
-                thread_id=thread_id,
-                agent_id=self.agent_id
-            )
+            # Wait for the run without holding the worker
+            run, error_msg = self.wait_for_run(thread_id, run)
+            if error_msg is None and run.status != RunStatus.COMPLETED:
+                error_msg = run_error_message(run)
             
-            if run.status == "failed":
-                error_msg = f"Agent run failed: {run.last_error}"
+            if error_msg:
                 logger.error(error_msg)
                 return {
                     "success": False,
@@ -82,21 +373,17 @@ class InvoiceAgentService:
                     "thread_id": thread_id
                 }
             
-            # Get messages from the thread
-            messages = self.project_client.agents.messages.list(
-                thread_id=thread_id, 
-                order=ListSortOrder.ASCENDING
-            )
+            # Only the reply produced by this run is needed; the full history
+            # is available from /api/invoice/thread/<thread_id>/messages
+            latest = next(iter(self.project_client.agents.messages.list(
+                thread_id=thread_id,
+                run_id=run.id,
+                limit=1,
+                order=ListSortOrder.DESCENDING
+            )), None)
             
             # Format response
-            conversation = []
-            for msg in messages:
-                if msg.text_messages:
-                    conversation.append({
-                        "role": msg.role,
-                        "content": msg.text_messages[-1].text.value,
-                        "timestamp": msg.created_at.isoformat() if hasattr(msg, 'created_at') else datetime.now().isoformat()
-                    })
+            conversation = format_conversation([latest] if latest else [])
             
             return {
                 "success": True,
@@ -105,127 +392,217 @@ class InvoiceAgentService:
                 "run_status": run.status
             }
             
-        except Exception as e:
-            error_msg = f"Error processing message: {str(e)}"
-            logger.error(error_msg)
+        except Exception:
+            error_msg = "Error processing message"
             return {
                 "success": False,
                 "error": error_msg,
+                "cid": log_exception(error_msg),
                 "thread_id": thread_id
             }
 
-# Initialize the service
-try:
-    invoice_service = InvoiceAgentService()
-except Exception as e:
-    logger.error(f"Failed to initialize invoice service: {str(e)}")
-    invoice_service = None
+class ChatRunner:
+    """Run chat requests with bounded concurrency, one run at a time per thread
+    
+    Both limits are per worker process. Messages for the same thread that
+    reach different gunicorn workers are not serialized against each other.
+    """
+    
+    def __init__(self, service, max_concurrency=CHAT_MAX_CONCURRENCY, wait_timeout=CHAT_WAIT_TIMEOUT):
+        self.service = service
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # thread_id -> [lock, number of requests holding or waiting on it]
+        self._thread_locks = {}
+        self._thread_locks_guard = threading.Lock()
+    
+    def run(self, user_message, thread_id=None):
+        """Process a message, raising TimeoutError if it cannot start in time"""
+        deadline = time.monotonic() + self.wait_timeout
+        # A thread accepts only one active run at a time, so requests for the
+        # same thread queue here; new threads are independent
+        with self._thread_turn(thread_id, deadline):
+            if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                raise TimeoutError("No chat slot became free in time")
+            try:
+                return self.service.process_invoice_message(user_message, thread_id)
+            finally:
+                self._slots.release()
+    
+    @contextmanager
+    def _thread_turn(self, thread_id, deadline):
+        """Hold the per-thread lock for thread_id, if any, until the block exits"""
+        if not thread_id:
+            yield
+            return
+        
+        with self._thread_locks_guard:
+            entry = self._thread_locks.setdefault(thread_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=max(deadline - time.monotonic(), 0)):
+                raise TimeoutError(f"Thread {thread_id} is busy with another run")
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            # Drop the lock once nobody is using it so the map does not grow
+            with self._thread_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._thread_locks[thread_id]
+
+@functools.lru_cache(maxsize=1)
+def get_service():
+    """Return the process-wide invoice service, creating it on first use"""
+    # Created lazily so each gunicorn worker builds its own client after fork
+    return InvoiceAgentService()
+
+# lru_cache does not keep exceptions, so a failed setup is remembered here and
+# retried at most once per SERVICE_RETRY_SECONDS instead of on every request
+SERVICE_RETRY_SECONDS = float(os.getenv('SERVICE_RETRY_SECONDS', 60))
+_SERVICE_FAILURE = {"ts": None}
+
+def get_service_or_none():
+    """Return the invoice service, or None if it cannot be created"""
+    failed_at = _SERVICE_FAILURE["ts"]
+    if failed_at is not None and time.monotonic() - failed_at < SERVICE_RETRY_SECONDS:
+        return None
+    try:
+        service = get_service()
+    except Exception as e:
+        _SERVICE_FAILURE["ts"] = time.monotonic()
+        logger.error(f"Failed to initialize invoice service: {str(e)}")
+        return None
+    _SERVICE_FAILURE["ts"] = None
+    return service
+
+@functools.lru_cache(maxsize=1)
+def get_chat_runner(service):
+    """Return the chat runner for the process-wide invoice service"""
+    return ChatRunner(service)
+
+# Readiness/liveness probes hit / every few seconds; within a second of the
+# last rebuild the encoded body is returned without touching the service
+HEALTH_CACHE_SECONDS = 1.0
+_HEALTH_CACHE = {"ts": None, "body": b""}
 
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
-        "service": "Invoice Agent API",
-        "timestamp": datetime.now().isoformat(),
-        "agent_available": invoice_service is not None
-    })
+    now = time.monotonic()
+    if _HEALTH_CACHE["ts"] is None or now - _HEALTH_CACHE["ts"] >= HEALTH_CACHE_SECONDS:
+        # Only says whether the client could be built; the agent itself is
+        # first contacted by the first chat request
+        _HEALTH_CACHE["body"] = orjson.dumps({
+            "status": "healthy",
+            "service": "Invoice Agent API",
+            "timestamp": _utcnow(),
+            "agent_available": get_service_or_none() is not None
+        }, option=JSON_OPTIONS)
+        _HEALTH_CACHE["ts"] = now
+    return app.response_class(_HEALTH_CACHE["body"], mimetype='application/json')
 
 @app.route('/api/invoice/chat', methods=['POST'])
 def chat_with_agent():
     """Chat with the invoice agent"""
+    invoice_service = get_service_or_none()
     if not invoice_service:
-        return jsonify({
-            "success": False,
-            "error": "Invoice service not available"
-        }), 503
+        return error_response(ERR_NO_SERVICE)
     
     try:
-        data = request.get_json()
+        # cache=False keeps Flask from holding a second copy in request.data
+        try:
+            raw = request.get_data(cache=False)
+        except RequestEntityTooLarge:
+            return error_response(ERR_TOO_LARGE)
+        if len(raw) > MAX_REQUEST_BYTES:
+            return error_response(ERR_TOO_LARGE)
         
-        if not data or 'message' not in data:
-            return jsonify({
-                "success": False,
-                "error": "Missing 'message' in request body"
-            }), 400
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return error_response(ERR_INVALID_JSON)
+        
+        if not isinstance(data, dict) or 'message' not in data:
+            return error_response(ERR_MISSING_MESSAGE)
         
         user_message = data['message']
         thread_id = data.get('thread_id')  # Optional - will create new if not provided
+        if not isinstance(user_message, str) or not (thread_id is None or isinstance(thread_id, str)):
+            return error_response(ERR_INVALID_FIELDS)
         
-        result = invoice_service.process_invoice_message(user_message, thread_id)
+        try:
+            result = get_chat_runner(invoice_service).run(user_message, thread_id)
+        except TimeoutError:
+            return error_response(ERR_BUSY)
         
         if result['success']:
-            return jsonify(result)
+            return json_response(result)
         else:
-            return jsonify(result), 500
+            return json_response(result, 500)
             
-    except Exception as e:
-        logger.error(f"Error in chat endpoint: {str(e)}")
-        return jsonify({
-            "success": False,
-            "error": f"Internal server error: {str(e)}"
-        }), 500
+    except Exception:
+        return internal_error("Internal server error")
 
 @app.route('/api/invoice/new-thread', methods=['POST'])
 def create_new_thread():
     """Create a new conversation thread"""
+    invoice_service = get_service_or_none()
     if not invoice_service:
-        return jsonify({
-            "success": False,
-            "error": "Invoice service not available"
-        }), 503
+        return error_response(ERR_NO_SERVICE)
     
     try:
         thread = invoice_service.project_client.agents.threads.create()
-        return jsonify({
+        return json_response({
             "success": True,
             "thread_id": thread.id,
-            "created_at": datetime.now().isoformat()
+            "created_at": _utcnow()
         })
-    except Exception as e:
-        logger.error(f"Error creating thread: {str(e)}")
-        return jsonify({
-            "success": False,
-            "error": f"Failed to create thread: {str(e)}"
-        }), 500
+    except Exception:
+        return internal_error("Failed to create thread")
 
 @app.route('/api/invoice/thread/<thread_id>/messages', methods=['GET'])
 def get_thread_messages(thread_id):
-    """Get all messages from a thread"""
+    """Get a page of messages from a thread (?limit= and ?after= cursor)"""
+    invoice_service = get_service_or_none()
     if not invoice_service:
-        return jsonify({
-            "success": False,
-            "error": "Invoice service not available"
-        }), 503
+        return error_response(ERR_NO_SERVICE)
     
     try:
-        messages = invoice_service.project_client.agents.messages.list(
-            thread_id=thread_id,
-            order=ListSortOrder.ASCENDING
-        )
-        
-        conversation = []
-        for msg in messages:
-            if msg.text_messages:
-                conversation.append({
-                    "role": msg.role,
-                    "content": msg.text_messages[-1].text.value,
-                    "timestamp": msg.created_at.isoformat() if hasattr(msg, 'created_at') else datetime.now().isoformat()
-                })
+        limit = int(request.args.get('limit', MESSAGES_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MESSAGES_MAX_LIMIT:
+        return error_response(ERR_INVALID_LIMIT)
+    after = request.args.get('after')
+    
+    try:
+        conversation, next_cursor = invoice_service.list_conversation(thread_id, limit, after)
         
-        return jsonify({
+        return json_response({
             "success": True,
             "thread_id": thread_id,
-            "messages": conversation
+            "messages": conversation,
+            "next_cursor": next_cursor
         })
         
-    except Exception as e:
-        logger.error(f"Error getting thread messages: {str(e)}")
-        return jsonify({
-            "success": False,
-            "error": f"Failed to get messages: {str(e)}"
-        }), 500
+    except ResourceNotFoundError:
+        return error_response(ERR_THREAD_NOT_FOUND)
+    except HttpResponseError as e:
+        # Auth failures are the server's misconfiguration, not the caller's
+        if e.status_code is not None and 400 <= e.status_code < 500 and e.status_code not in (401, 403):
+            logger.warning(f"Rejected messages query for thread {thread_id}: {e.status_code}")
+            return error_response(ERR_INVALID_MESSAGES_QUERY)
+        return internal_error("Failed to get messages")
+    except Exception:
+        return internal_error("Failed to get messages")
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    if os.getenv('USE_GEVENT'):
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('0.0.0.0', port), app).serve_forever()
+    else:
+        app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -3,13 +3,24 @@ Test client for Invoice Agent API
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 class InvoiceAgentClient:
     def __init__(self, base_url):
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        # Default pools hold 10 connections, which would serialize chat_many
+        adapter = HTTPAdapter(
+            pool_connections=64,
+            pool_maxsize=64,
+            max_retries=Retry(total=3, backoff_factor=0.1)
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
     
     def health_check(self):
         """Check if the API is healthy"""
@@ -43,13 +54,44 @@ class InvoiceAgentClient:
         except Exception as e:
             return {"error": str(e)}
     
-    def get_messages(self, thread_id):
-        """Get all messages from a thread"""
+    def chat_many(self, messages, max_workers=16):
+        """Send several messages concurrently, each on its own new thread
+        
+        A thread allows only one active run, so concurrent messages cannot
+        share one; results are returned in input order.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.chat, messages))
+    
+    def get_messages(self, thread_id, limit=None, after=None):
+        """Get one page of messages from a thread, oldest first"""
         try:
-            response = self.session.get(f"{self.base_url}/api/invoice/thread/{thread_id}/messages")
+            params = {}
+            if limit:
+                params["limit"] = limit
+            if after:
+                params["after"] = after
+            
+            response = self.session.get(
+                f"{self.base_url}/api/invoice/thread/{thread_id}/messages",
+                params=params
+            )
             return response.json()
         except Exception as e:
             return {"error": str(e)}
+    
+    def get_latest_message(self, thread_id):
+        """Follow the page cursors to the newest message of a thread"""
+        latest = None
+        after = None
+        while True:
+            result = self.get_messages(thread_id, limit=100, after=after)
+            messages = result.get("messages") or []
+            if messages:
+                latest = messages[-1]
+            after = result.get("next_cursor")
+            if not after:
+                return latest
 
 def test_local():
     """Test the API running locally"""
@@ -75,23 +117,19 @@ def test_local():
         chat_result = client.chat("", thread_id)
         # print(json.dumps(chat_result, indent=2))
         
-        # Get all messages
+        # Get the latest message
         print("\nResults:")
-        messages_result = client.get_messages(thread_id)
-        # print(json.dumps(messages_result, indent=2))
+        latest_message = client.get_latest_message(thread_id)
+        # print(json.dumps(latest_message, indent=2))
         # Print only the latest message (robust to a few common response shapes)
-        msgs = messages_result.get("messages")[-1].get("content")
-        msgs_json = json.loads(msgs)
+        msgs = latest_message.get("content") if latest_message else None
+        try:
+            msgs_json = json.loads(msgs)
+        except (TypeError, json.JSONDecodeError):
+            msgs_json = []
         for item in msgs_json:
             print(item)
 
-    # print(json.dumps(messages_result, indent=2))
-    # Print only the latest message (robust to a few common response shapes)
-    msgs = messages_result.get("messages")[-1].get("content")
-    msgs_json = json.loads(msgs)
-    for item in msgs_json:
-        print(item)
-
 def test_azure(app_url):
     """Test the API running on Azure Container Apps"""
     client = InvoiceAgentClient(app_url)